@@ -1,32 +1,430 @@
 #!/usr/bin/env python3
+import functools
+import hashlib
 import subprocess
 import sys
 import json
 import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import MappingProxyType
+
+# Parser imports are deferred until there is actually something to scan, so
+# an invocation with no staged YAML exits without paying the PyYAML/orjson
+# import cost.
+yaml = None
+_BaseLoader = None
+_json_loads = json.loads
+_ijson = None
+
+
+def _load_parsers():
+    """Import the parsers on first use.
+
+    libyaml's C tokenizer is several times faster than the pure-Python
+    loader; install PyYAML with libyaml support (e.g. `pip install pyyaml`
+    on a system with libyaml-dev) to get it. orjson decodes kubescape's
+    JSON several times faster than stdlib and works directly on the
+    undecoded bytes; json.loads accepts bytes too as the fallback. ijson,
+    when installed, lets the scan results stream off the kubescape pipe."""
+    global yaml, _BaseLoader, _json_loads, _ijson
+    if yaml is not None:
+        return
+    try:
+        import yaml
+    except ImportError:
+        print("Error: PyYAML not found. Install it with libyaml support "
+              "(pip install pyyaml) and re-run.", file=sys.stderr)
+        sys.exit(1)
+    try:
+        from yaml import CSafeLoader as _BaseLoader
+    except ImportError:
+        from yaml import SafeLoader as _BaseLoader
+    try:
+        from orjson import loads as _json_loads
+    except ImportError:
+        pass
+    try:
+        import ijson as _ijson
+    except ImportError:
+        pass
+
+class GitBatch:
+    """Stream staged blobs from one long-running `git cat-file --batch`
+    process instead of paying a git spawn per file"""
+
+    def __enter__(self):
+        self._proc = subprocess.Popen(
+            ["git", "cat-file", "--batch=%(objectname) %(objecttype) %(objectsize)"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,  # outside a repo, git's noise isn't ours
+        )
+        self._lock = threading.Lock()
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self._proc.stdin.close()
+            self._proc.stdout.close()
+        except OSError:
+            pass  # the child died already (e.g. not a git repository)
+        self._proc.wait()
+
+    def read_staged(self, path):
+        """Return the staged bytes for path, or None if there is no staged blob"""
+        with self._lock:
+            try:
+                self._proc.stdin.write(f":{path}\n".encode())
+                self._proc.stdin.flush()
+                header = self._proc.stdout.readline().split()
+                if len(header) != 3:
+                    return None  # "<input> missing" -- no body follows
+                size = int(header[2])
+                data = self._proc.stdout.read(size + 1)[:size]  # body + newline
+                if header[1] != b"blob":
+                    return None
+                return data
+            except (OSError, ValueError):
+                return None
+
+
+def _staged_list_cache():
+    """Locate the shared staged-list cache and the index mtime that keys it.
+
+    Returns (cache_path, index_mtime), either of which may be None when the
+    repo layout cannot be determined."""
+    git_dir = _git_dir()
+    if not git_dir:
+        return None, None
+    index = os.environ.get("GIT_INDEX_FILE", os.path.join(git_dir, "index"))
+    try:
+        index_mtime = os.stat(index).st_mtime_ns
+    except OSError:
+        return None, None
+    return Path(git_dir) / "precommit-staged.list", index_mtime
+
 
 def get_staged_yaml_files():
-    """Get staged YAML files"""
+    """Get staged YAML files.
+
+    pre-commit invokes hooks with the changed paths as argv; prefer those and
+    only fall back to asking git. The git answer is cached in $GIT_DIR keyed
+    on the index mtime, so sibling hooks in the same commit share one query."""
+    argv = [a for a in sys.argv[1:] if a.endswith((".yaml", ".yml"))]
+    if argv:
+        return argv
+    cache_path, index_mtime = _staged_list_cache()
+    if cache_path is not None:
+        try:
+            stamp, _, body = cache_path.read_text().partition("\n")
+            if int(stamp) == index_mtime:
+                return [f for f in body.splitlines() if f.endswith((".yaml", ".yml"))]
+        except (OSError, ValueError):
+            pass
     output = subprocess.run(
         ["git", "diff", "--cached", "--name-only", "--diff-filter=ACM"],
         capture_output=True,
         text=True
     )
-    files = [f for f in output.stdout.splitlines() if f.endswith((".yaml", ".yml"))]
-    return files
+    staged = output.stdout.splitlines()
+    if cache_path is not None:
+        try:
+            tmp = cache_path.with_suffix(".tmp")
+            tmp.write_text("\n".join([str(index_mtime)] + staged))
+            os.replace(tmp, cache_path)
+        except OSError:
+            pass
+    return [f for f in staged if f.endswith((".yaml", ".yml"))]
+
+
+def _mapping_get(node, key):
+    """Return the value node for key in a YAML mapping node, or None.
+
+    Follows '<<' merge keys so anchored securityContext blocks still count."""
+    if not isinstance(node, yaml.MappingNode):
+        return None
+    merged = None
+    for key_node, value_node in node.value:
+        if key_node.value == key:
+            return value_node
+        if key_node.tag == "tag:yaml.org,2002:merge":
+            merged = value_node
+    if merged is not None:
+        if isinstance(merged, yaml.SequenceNode):
+            for item in merged.value:
+                found = _mapping_get(item, key)
+                if found is not None:
+                    return found
+        else:
+            return _mapping_get(merged, key)
+    return None
+
+
+def _scalar(node):
+    return node.value if isinstance(node, yaml.ScalarNode) else None
+
+
+def _doc_summary(node):
+    """Extract (kind, name, namespace, line) from a composed document node.
+
+    Root-container detection itself is kubescape's job (controls C-0013 and
+    C-0057); the Python side only keeps enough structure to pin kubescape's
+    findings to a staged file and line."""
+    kind = _scalar(_mapping_get(node, "kind"))
+    metadata = _mapping_get(node, "metadata")
+    name = _scalar(_mapping_get(metadata, "name"))
+    namespace = _scalar(_mapping_get(metadata, "namespace"))
+    return kind, name, namespace, node.start_mark.line + 1
+
+
+@functools.lru_cache(maxsize=64)
+def _parse_bytes(key, data):
+    """Summarize YAML bytes once per content hash; key keeps the cache
+    content-addressed.
 
-def scan_file(file_path):
-    """Run kubescape scan for a single file using NSA framework"""
+    Most staged manifests hold a single document, so a byte peek for the
+    '---' separator picks plain compose() over the compose_all generator;
+    a false hit (e.g. '---' inside a block scalar) only means taking the
+    slower multi-document path, never a wrong parse."""
+    if not data.startswith(b"---") and b"\n---" not in data:
+        node = yaml.compose(data, Loader=_BaseLoader)
+        return (_doc_summary(node),) if isinstance(node, yaml.MappingNode) else ()
+    return tuple(_doc_summary(node)
+                 for node in yaml.compose_all(data, Loader=_BaseLoader)
+                 if isinstance(node, yaml.MappingNode))
+
+
+def _read_staged(file_path, git_batch=None):
+    """Read the bytes under scan: the staged blob (what the commit will
+    actually contain) when available, else the worktree copy"""
+    data = git_batch.read_staged(file_path) if git_batch else None
+    if data is None:
+        data = Path(file_path).read_bytes()
+    return data
+
+
+def scan_docs(file_path, docs):
+    """Map (kind, name, namespace) -> (file, line) so kubescape findings
+    get a location"""
+    mapping = {}
+    for kind, name, namespace, line in docs:
+        if kind and name:
+            mapping[(kind, name, namespace)] = (file_path, line)
+    return mapping
+
+
+def _scan_one(file_path, git_batch=None):
+    """scan_docs wrapper that captures read and YAML errors so it is safe in
+    workers.
+
+    Also returns the sha256 of the scanned bytes, which keys the persistent
+    kubescape result cache (None when the file could not be read)."""
     try:
-        result = subprocess.run(
-            ["kubescape", "scan", "framework", "nsa", file_path, "--format", "json"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        # kubescape returns non-zero on failed scan, still captures output
-        return e.stdout
+        data = _read_staged(file_path, git_batch)
+    except OSError as e:
+        return file_path, None, {}, e
+    # one hash pass serves both the persistent kubescape cache and the
+    # in-process parse cache
+    digest = hashlib.sha256(data).hexdigest()
+    try:
+        return file_path, digest, scan_docs(file_path, _parse_bytes(digest, data)), None
+    except yaml.YAMLError as e:
+        return file_path, digest, {}, e
+
+
+CACHE_LIMIT = 200
+
+
+@functools.lru_cache(maxsize=1)
+def _git_dir():
+    out = subprocess.run(["git", "rev-parse", "--git-dir"], capture_output=True, text=True)
+    return out.stdout.strip() or None
+
+
+@functools.lru_cache(maxsize=1)
+def _kubescape_version():
+    """kubescape's version participates in the cache key so upgrades
+    invalidate stale results; None disables the cache.
+
+    The probe itself is persisted keyed on the binary's mtime, so a warm run
+    whose files are all cached spawns kubescape zero times."""
+    binary = shutil.which("kubescape")
+    if binary is None:
+        return None
+    try:
+        stamp = str(os.stat(binary).st_mtime_ns)
+    except OSError:
+        return None
+    git_dir = _git_dir()
+    version_file = Path(git_dir) / "kubescape-precommit-version" if git_dir else None
+    if version_file is not None:
+        try:
+            cached_stamp, _, cached_version = version_file.read_text().partition(" ")
+            if cached_stamp == stamp and cached_version:
+                return cached_version
+        except OSError:
+            pass
+    out = subprocess.run(["kubescape", "version"], capture_output=True, text=True)
+    version = out.stdout.strip() or None
+    if version_file is not None and version:
+        try:
+            version_file.write_text(f"{stamp} {version}")
+        except OSError:
+            pass
+    return version
+
+
+def _kubescape_cache_dir():
+    """Per-repo cache directory under .git, or None when unavailable"""
+    git_dir = _git_dir()
+    if not git_dir or _kubescape_version() is None:
+        return None
+    cache_dir = Path(git_dir) / "kubescape-precommit-cache"
+    try:
+        cache_dir.mkdir(exist_ok=True)
+    except OSError:
+        return None
+    return cache_dir
+
+
+def _cache_load(cache_dir, digest):
+    """Return cached kubescape resources for a content digest, or None"""
+    if cache_dir is None:
+        return None
+    entry = cache_dir / f"{digest}.json"
+    try:
+        payload = json.loads(entry.read_text())
+        entry.touch()  # refresh mtime so trimming is least-recently-used
+    except (OSError, json.JSONDecodeError):
+        return None
+    if payload.get("version") != _kubescape_version():
+        return None
+    return payload.get("resources", [])
+
+
+def _cache_store(cache_dir, digest, resources):
+    if cache_dir is None:
+        return
+    entry = cache_dir / f"{digest}.json"
+    try:
+        entry.write_text(json.dumps({"version": _kubescape_version(),
+                                     "resources": resources}))
+    except OSError:
+        pass
+
+
+def _cache_trim(cache_dir, limit=CACHE_LIMIT):
+    """Drop least-recently-used cache entries beyond limit"""
+    if cache_dir is None:
+        return
+    try:
+        entries = sorted(cache_dir.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    except OSError:
+        return
+    for stale in entries[:-limit]:
+        try:
+            stale.unlink()
+        except OSError:
+            pass
+
+
+def run_kubescape(files):
+    """Run one kubescape NSA scan over the staged copies of files and yield
+    resources as kubescape emits them.
+
+    kubescape reads from disk, so the staged blobs are materialized into a
+    temp directory with plain Python writes (no per-file execs); that keeps
+    the scan consistent with what the commit will actually contain. Files
+    without a staged blob fall back to their worktree path.
+
+    With ijson installed, the JSON is parsed incrementally off the pipe so
+    Python-side extraction overlaps kubescape's own emission; otherwise the
+    whole payload is buffered and decoded in one go. Raises ValueError when
+    the output is not valid JSON (kubescape's non-zero exits for findings
+    are expected and ignored)."""
+    with tempfile.TemporaryDirectory(prefix="kubescape-precommit-") as tmp, \
+            GitBatch() as git_batch:
+        tmp_root = Path(tmp)
+        scan_paths = []
+        for f in files:
+            data = git_batch.read_staged(f)
+            if data is None:
+                scan_paths.append(f)
+                continue
+            dest = tmp_root / f
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            dest.write_bytes(data)
+            scan_paths.append(str(dest))
+        try:
+            proc = subprocess.Popen(
+                ["kubescape", "scan", "framework", "nsa", *scan_paths, "--format", "json"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        except FileNotFoundError:
+            print("Error: kubescape CLI not found. Install it and ensure it's on PATH.", file=sys.stderr)
+            sys.exit(1)
+        try:
+            if _ijson is not None:
+                try:
+                    # use_float keeps numbers JSON-serializable for the
+                    # result cache (ijson defaults floats to Decimal)
+                    yield from _ijson.items(proc.stdout, "resources.item",
+                                            use_float=True)
+                except _ijson.JSONError as e:
+                    raise ValueError(str(e)) from e
+            else:
+                data = _json_loads(proc.stdout.read())
+                yield from data.get("resources", ())
+        finally:
+            proc.stdout.close()
+            proc.wait()
+
+
+def _locate_resource(resource_map, resource):
+    """Find the staged (file, line) for a kubescape resource.
+
+    Tries the exact (kind, name, namespace) key first, then the
+    namespace-less entry, since manifests often omit metadata.namespace
+    even when kubescape reports one."""
+    key = (resource.get("kind"), resource.get("name"),
+           resource.get("namespace") or None)
+    location = resource_map.get(key)
+    if location is None and key[2] is not None:
+        location = resource_map.get((key[0], key[1], None))
+    return location
+
+
+def parse_kubescape_critical(data, resource_map, duplicate_paths=None):
+    """Yield formatted kubescape findings, annotated with file:line where
+    known.
+
+    A generator rather than a list: the formatted messages are printed by
+    main() as it iterates, so large NSA outputs never hold a second
+    in-memory copy of every message (the scan itself is drained before this
+    runs, for cache attribution). duplicate_paths maps a file to every
+    staged path with identical content, so a finding on one templated copy
+    is reported against each of them."""
+    for resource in data.get("resources", ()):
+        kind = resource.get("kind")
+        name = resource.get("name")
+        location = _locate_resource(resource_map, resource)
+        if location:
+            paths = (duplicate_paths or {}).get(location[0], (location[0],))
+            wheres = [f"{path}:{location[1]}" for path in paths]
+        else:
+            wheres = [f"{kind}/{name}"]
+        for result in resource.get("results", ()):
+            severity = result.get("severity", "Unknown")
+            message = result.get("message", "")
+            control_name = result.get("controlName", "")
+            for where in wheres:
+                yield f"❌ {severity.upper()} issue in {where}: [{control_name}] {message}"
+
 
 def main():
     files = get_staged_yaml_files()
@@ -35,25 +433,92 @@ def main():
         sys.exit(0)
 
     has_issues = False
+    _load_parsers()
+
+    # libyaml releases the GIL while tokenizing and file reads block, so the
+    # per-file scans parallelize well; results come back in file order.
+    with GitBatch() as git_batch, \
+            ThreadPoolExecutor(max_workers=min(8, len(files))) as executor:
+        results = list(executor.map(
+            functools.partial(_scan_one, git_batch=git_batch), files))
+
+    resource_map = {}
+    key_owners = {}
+    digests = {}
+    for f, digest, mapping, error in results:
+        digests[f] = digest
+        if error is not None:
+            if isinstance(error, OSError):
+                print(f"❌ {f}: {error}")
+            else:
+                print(f"❌ {f} is not valid YAML: {error}")
+            has_issues = True
+            continue
+        for key in mapping:
+            key_owners.setdefault(key, set()).add(digest)
+        resource_map.update(mapping)
+
+    # A key declared by files with different contents is ambiguous: drop it,
+    # so findings fall back to the kind/name label instead of pinning an
+    # arbitrary file, and so the unattributable-resource guard below keeps
+    # every implicated digest out of the result cache -- an empty entry must
+    # never be cached for a file whose findings were credited elsewhere.
+    for key, owners in key_owners.items():
+        if len(owners) > 1:
+            del resource_map[key]
+
+    # Population is done: freeze the map so the finding loop reads from an
+    # immutable view and nothing downstream can mutate or rehash it.
+    resource_map = MappingProxyType(resource_map)
 
+    # kubescape results are deterministic in file content, so unchanged files
+    # are served from the per-repo cache and only the rest get scanned.
+    cache_dir = _kubescape_cache_dir()
+    resources = []
+    to_scan = []
+    # byte-identical duplicates (templated manifests are common) share one
+    # scan and one cache slot, and findings fan back out to every copy
+    digest_groups = {}
     for f in files:
-        output = scan_file(f)
+        if digests[f] is not None:  # unreadable files were reported above
+            digest_groups.setdefault(digests[f], []).append(f)
+    duplicate_paths = {f: tuple(group)
+                       for group in digest_groups.values() for f in group}
+    for digest, group in digest_groups.items():
+        cached = _cache_load(cache_dir, digest)
+        if cached is None:
+            to_scan.append(group[0])
+        else:
+            resources.extend(cached)
+
+    if to_scan:
         try:
-            data = json.loads(output)
-        except json.JSONDecodeError:
-            print(f"❌ Kubescape output for {f} is not valid JSON.")
-            print(output)
+            fresh = list(run_kubescape(to_scan))
+        except ValueError as e:
+            print(f"❌ Kubescape output is not valid JSON: {e}")
             has_issues = True
-            continue
+        else:
+            resources.extend(fresh)
+            per_digest = {digests[f]: [] for f in to_scan}
+            attributed = True
+            for res in fresh:
+                location = _locate_resource(resource_map, res)
+                digest = digests.get(location[0]) if location else None
+                if digest in per_digest:
+                    per_digest[digest].append(res)
+                else:
+                    attributed = False
+            # Only cache when every fresh resource landed in a digest entry;
+            # otherwise a warm run would silently drop the stray findings.
+            if attributed:
+                for digest, digest_resources in per_digest.items():
+                    _cache_store(cache_dir, digest, digest_resources)
+                _cache_trim(cache_dir)
 
-        # Traverse JSON for all severity findings
-        for resource in data.get("resources", []):
-            for result in resource.get("results", []):
-                severity = result.get("severity", "Unknown")
-                message = result.get("message", "")
-                control_name = result.get("controlName", "")
-                print(f"❌ {severity.upper()} issue in {f}: [{control_name}] {message}")
-                has_issues = True
+    for finding in parse_kubescape_critical({"resources": resources},
+                                            resource_map, duplicate_paths):
+        print(finding)
+        has_issues = True
 
     if has_issues:
         sys.exit(1)
@@ -1,20 +1,57 @@
 #!/usr/bin/env python3
+import os
 import subprocess
 import sys
 import json
 
+# orjson decodes large kubescape payloads several times faster than stdlib
+# and takes the raw bytes; json.loads accepts bytes too as a fallback.
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
 def get_staged_yaml_files():
+    # pre-commit passes the changed paths as argv; only ask git when invoked
+    # without them (e.g. by hand)
+    argv = [a for a in sys.argv[1:] if a.endswith((".yaml", ".yml"))]
+    if argv:
+        return argv
+    # Sibling hooks in the same commit share one git query via a small cache
+    # in $GIT_DIR keyed on the index mtime; only usable when git exported the
+    # hook environment (no extra spawn to discover the repo layout).
+    git_dir = os.environ.get("GIT_DIR")
+    index = os.environ.get("GIT_INDEX_FILE") or (os.path.join(git_dir, "index") if git_dir else None)
+    cache_path = os.path.join(git_dir, "precommit-staged.list") if git_dir else None
+    index_mtime = None
+    if cache_path and index:
+        try:
+            index_mtime = os.stat(index).st_mtime_ns
+            with open(cache_path) as fh:
+                stamp, *staged = fh.read().splitlines()
+            if int(stamp) == index_mtime:
+                return [f for f in staged if f.endswith((".yaml", ".yml"))]
+        except (OSError, ValueError):
+            pass
     result = subprocess.run(
         ["git", "diff", "--cached", "--name-only", "--diff-filter=ACM"],
         capture_output=True,
         text=True,
     )
-    return [f for f in result.stdout.splitlines() if f.endswith((".yaml", ".yml"))]
+    staged = result.stdout.splitlines()
+    if cache_path and index_mtime is not None:
+        try:
+            with open(cache_path + ".tmp", "w") as fh:
+                fh.write("\n".join([str(index_mtime)] + staged))
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError:
+            pass
+    return [f for f in staged if f.endswith((".yaml", ".yml"))]
 
 def run_kubescape(files):
     if not files:
         print("No staged YAML files to scan with Kubescape.")
-        return 0, "{}"
+        return 0, b"{}"
 
     cmd = [
         "kubescape",
@@ -28,10 +65,10 @@ def run_kubescape(files):
         "stdout",
     ]
     try:
-        completed = subprocess.run(cmd, capture_output=True, text=True, check=False)
+        completed = subprocess.run(cmd, capture_output=True, check=False)
         if not completed.stdout.strip():
             print("Kubescape produced no JSON output. Are your files valid YAML?")
-            return 1, "{}"
+            return 1, b"{}"
         return completed.returncode, completed.stdout
     except FileNotFoundError:
         print("Error: kubescape CLI not found. Install it and ensure it's on PATH.", file=sys.stderr)
@@ -39,10 +76,10 @@ def run_kubescape(files):
 
 def check_critical_findings(json_output):
     try:
-        data = json.loads(json_output)
-    except json.JSONDecodeError:
+        data = _json_loads(json_output)
+    except ValueError:
         print("Error: Kubescape output is not valid JSON. Here's the raw output:")
-        print(json_output)
+        print(json_output.decode(errors="replace"))
         sys.exit(1)
 
     critical = [